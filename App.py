@@ -1,7 +1,8 @@
 import badger2040
+import gc
 import time
 
-__all__ = ["App","AbstractScreen","NO_UPDATE"]
+__all__ = ["App","AbstractScreen","BufferPool","NO_UPDATE"]
 
 """ Returned from OnSleep to indicate the screen does not need to update"""
 NO_UPDATE = -1
@@ -20,6 +21,163 @@ class AbstractScreen():
     def drawAll(self):
         pass
 
+class BufferPool():
+    """A pool of buffers shared by all the screens of an App, to stop each screen holding on to its
+    own long lived buffers and fragmenting the heap.
+    Buffers are either borrowed, and given back when the screen is done with them, or cached under
+    a key, so they can be dropped whenever memory is needed elsewhere. Everything the pool hands out
+    counts towards its budget, when a new buffer would go over budget free buffers are released
+    and then the least recently used cached buffers are evicted to make room.
+    The budget is the pool's only view of memory pressure, it cannot see allocations made outside
+    of it. The App flushes the pool when a button handler runs out of memory, see App.loop.
+    """
+
+    def __init__(self,budget):
+        """Create a new buffer pool.
+
+        Args:
+            budget (int): Maximum number of bytes the pool may have allocated at once
+        """
+        self.budget = budget
+        self.used = 0
+        self.freeBytes = 0
+        self.peak = 0
+        self._freeLists = {}
+        self._cache = {}
+        self._cacheOrder = []
+
+    def borrow(self,size):
+        """Borrows a buffer from the pool, reusing a free one of the same size if there is one.
+        The contents of the buffer are not cleared. Give it back with giveBack when finished.
+
+        Args:
+            size (int): Size of the buffer in bytes, for a 1-bit image this is width*height//8
+
+        Raises:
+            MemoryError: If the buffer is bigger than the budget, or there is no room left in the
+                budget even after evicting all caches
+
+        Returns:
+            bytearray: The buffer
+        """
+        if size > self.budget:
+            raise MemoryError(f"Buffer of {size} bytes is bigger than the pool budget of {self.budget}")
+        while True:
+            freeList = self._freeLists.get(size)
+            if freeList:
+                buf = freeList.pop()
+                if not freeList:
+                    del self._freeLists[size]
+                self.freeBytes -= size
+                self._updatePeak()
+                return buf
+            if self.used+size <= self.budget:
+                return self._allocate(size)
+            if self._freeLists:
+                self._release()
+            elif self._cacheOrder:
+                self.evict(self._cacheOrder[0])
+            else:
+                raise MemoryError(f"Buffer pool budget exceeded, {size} bytes needed {self.report()}")
+
+    def giveBack(self,buf):
+        """Gives a borrowed buffer back to the pool, it must not be used after this.
+
+        Args:
+            buf (bytearray): The buffer to give back
+
+        Raises:
+            ValueError: If the buffer is already free, or more is given back than was borrowed
+        """
+        size = len(buf)
+        freeList = self._freeLists.setdefault(size,[])
+        if any(b is buf for b in freeList):
+            raise ValueError("Buffer was already given back to the pool")
+        if self.freeBytes+size > self.used:
+            raise ValueError("Buffer was not borrowed from the pool")
+        freeList.append(buf)
+        self.freeBytes += size
+
+    def cached(self,key,size,fill):
+        """Returns the buffer cached under key, if it's not cached a buffer is borrowed and
+        fill(key,buf) is called to fill it in. Cached buffers may be evicted by any later call on
+        the pool, so the buffer returned should only be used until then.
+
+        Args:
+            key (any): The key the buffer is cached under, e.g. a file name
+            size (int): Size of the buffer in bytes
+            fill (callable): Called as fill(key,buf) to fill in a new buffer
+
+        Returns:
+            bytearray: The cached buffer
+        """
+        buf = self._cache.get(key)
+        if buf is not None:
+            self._cacheOrder.remove(key)
+            self._cacheOrder.append(key)
+            return buf
+        buf = self.borrow(size)
+        try:
+            fill(key,buf)
+        except:
+            # Drop the buffer rather than keep it idle, it may have cost other entries their place
+            self.used -= size
+            raise
+        self._cache[key] = buf
+        self._cacheOrder.append(key)
+        return buf
+
+    def evict(self,key):
+        """Evicts the buffer cached under key, if there is one, giving it back to the pool.
+
+        Args:
+            key (any): The key to evict
+        """
+        buf = self._cache.pop(key,None)
+        if buf is not None:
+            self._cacheOrder.remove(key)
+            self.giveBack(buf)
+
+    def flush(self):
+        """Evicts all cached buffers and releases all free buffers, so they can be garbage collected"""
+        while self._cacheOrder:
+            self.evict(self._cacheOrder[0])
+        while self._freeLists:
+            self._release()
+
+    def report(self):
+        """Returns a short description of how much memory the pool is using
+
+        Returns:
+            str: The bytes in use, idle on the free list, at peak use, and budgeted
+        """
+        return f"{self.used-self.freeBytes}/{self.budget} bytes used, {self.freeBytes} free, peak {self.peak}, {len(self._cache)} cached"
+
+    def _allocate(self,size):
+        try:
+            buf = bytearray(size)
+        except MemoryError:
+            # The heap is too full or fragmented, drop all we can and try again
+            self.flush()
+            gc.collect()
+            buf = bytearray(size)
+        self.used += size
+        self._updatePeak()
+        return buf
+
+    def _updatePeak(self):
+        if self.used-self.freeBytes > self.peak:
+            self.peak = self.used-self.freeBytes
+
+    def _release(self):
+        size, freeList = next(iter(self._freeLists.items()))
+        if freeList:
+            freeList.pop()
+            self.used -= size
+            self.freeBytes -= size
+        if not freeList:
+            del self._freeLists[size]
+
 class App():
     """An App, a system for showing screens to the user and handling their button presses. Apps are
     designed to be user button pressed and not designed (yet) for running background tasks.
@@ -33,7 +191,7 @@ class App():
         "user":badger2040.BUTTON_USER,
     }
 
-    def __init__(self,badger,*,timeToSleep=30,ledHalt=85,ledInactive=170,ledActive=0):
+    def __init__(self,badger,*,timeToSleep=30,ledHalt=85,ledInactive=170,ledActive=0,memoryBudget=6144):
         """Create a new app, for more on apps see the help on the type.
 
         Args:
@@ -46,9 +204,13 @@ class App():
             ledHalt (int, optional): Brightness of the LED whilst sleeping, not on battery power the LED is off while sleeping. Defaults to 85.
             ledInactive (int, optional): Brightness of the LED while the app is idle and can accept user input. Defaults to 170.
             ledActive (int, optional): Brightness of the LED while the app is active and processing. Defaults to 255.
+            memoryBudget (int, optional): Number of bytes the app's buffer pool may allocate for screens, a python managed frame buffer is added on top of this. Defaults to 6144, enough for a 128x128 image and eight 64x64 images.
         """
+        self.pool = BufferPool(memoryBudget)
         if badger == True:
-            self.framebuffer = bytearray(badger2040.WIDTH*badger2040.HEIGHT//8)
+            framebufferSize = badger2040.WIDTH*badger2040.HEIGHT//8
+            self.pool.budget += framebufferSize
+            self.framebuffer = self.pool.borrow(framebufferSize)
             self.badger = badger2040.Badger2040(self.framebuffer)
         elif isinstance(badger,bytearray):
             self.framebuffer = badger
@@ -143,7 +305,8 @@ class App():
 
     def loop(self):
         """Runs a single instance of the processing loop, which does the following:
-         1. Process user input, calling at most one of the `button_` methods on the active screen
+         1. Process user input, calling at most one of the `button_` methods on the active screen,
+            if it runs out of memory the buffer pool is flushed and the press is dropped
          2. Update the screen, if needed
          3. Check to see if the badger should sleep, and do so if needed
         """
@@ -157,7 +320,13 @@ class App():
                 if f is not None:
                     self.badger.led(self.ledActive)
                     activated = True
-                    f()
+                    try:
+                        f()
+                    except MemoryError:
+                        # The press is dropped, free up the pool's caches so the next one can succeed
+                        print("Loop out of memory, flushing buffer pool")
+                        self.pool.flush()
+                        gc.collect()
                     break
             if buttons:
                 print("Loop action buttons",buttons)
@@ -179,6 +348,7 @@ class App():
             self.badger.led(self.ledInactive)
             at = time.localtime(self.sleepAt)
             print(f"> Sleep will occur at {at[3]}:{at[4]}:{at[5]}")
+            print(f"> Buffer pool {self.pool.report()}")
             if self.nextUpdateAt is None:
                 print(f"> No update is queued")
             else:
@@ -50,13 +50,14 @@ class QR():
     
     def draw(self,ox,oy,origSize):
         size, mSize = self.measure(origSize)
+        w,h = self.code.get_size()
         ox += (origSize-size)//2
         oy += (origSize-size)//2
         self.badger.pen(15)
         self.badger.rectangle(ox,oy,size,size)
         self.badger.pen(0)
-        for x in range(size):
-            for y in range(size):
+        for y in range(h):
+            for x in range(w):
                 if self.code.get_module(x,y):
                     self.badger.rectangle(ox + x * mSize, oy + y * mSize, mSize, mSize)
 
@@ -67,7 +68,6 @@ class Badge(AbstractScreen):
         self.code = QR(app)
         self.showQr = False
         
-        self.image = bytearray(AVATAR_SIZE*AVATAR_SIZE//8)
         self.imageName = None
         self.lines = [None]*N_PRONOUNS
         self.pronouns = [None]*N_ABOUT_LINES
@@ -95,9 +95,10 @@ class Badge(AbstractScreen):
             },f)
     
     def setImage(self,imageFile):
+        if self.imageName != imageFile:
+            self.app.pool.evict(self.imageName)
         self.imageName = imageFile
-        with open(imageFile) as f:
-            f.readinto(self.image)
+        cachedFile(self.app.pool,imageFile,AVATAR_SIZE*AVATAR_SIZE//8)
     
     def drawText(self,textData,x,y):
         self.badger.font(FONT)
@@ -112,8 +113,12 @@ class Badge(AbstractScreen):
         self.badger.pen(BLACK)
         if self.showQr:
             self.code.draw(0,0,128)
-        else:
-            self.badger.image(self.image,AVATAR_SIZE,AVATAR_SIZE,0,0)
+        elif self.imageName is not None:
+            try:
+                image = cachedFile(self.app.pool,self.imageName,AVATAR_SIZE*AVATAR_SIZE//8)
+                self.badger.image(image,AVATAR_SIZE,AVATAR_SIZE,0,0)
+            except OSError:
+                pass #Leave the avatar blank
             
         self.badger.font(FONT)
         
@@ -341,6 +346,7 @@ class IconSelector(AbstractScreen):
         if newPage != self.page:
             self.badger.pen(WHITE)
             self.badger.clear()
+            self.evictPage()
             self.page = newPage
             self.drawPage()
             
@@ -355,12 +361,10 @@ class IconSelector(AbstractScreen):
         
         imgs = self.fileNames[self.page*ICONS_PER_PAGE:(1+self.page)*ICONS_PER_PAGE]
         for i,name in enumerate(imgs):
-            img = bytearray(ICON_SIZE**2//8)
             y,x=divmod(i,ICONS_ACROSS)
             
             try:
-                with open("badges/halfImages/"+name) as f:
-                    f.readinto(img)
+                img = cachedFile(self.app.pool,"badges/halfImages/"+name,ICON_SIZE**2//8)
                 self.badger.image(img,ICON_SIZE,ICON_SIZE,x*ICON_SIZE,y*ICON_SIZE)
             except OSError:
                 self.badger.font(FONT)
@@ -370,6 +374,10 @@ class IconSelector(AbstractScreen):
                 drawWrappedText(name[:-4],x*ICON_SIZE+2,y*ICON_SIZE+2,ICON_SIZE-4,2,16)
 
         self.app.queueUpdate(0,badger2040.UPDATE_FAST)
+    
+    def evictPage(self):
+        for name in self.fileNames[self.page*ICONS_PER_PAGE:(1+self.page)*ICONS_PER_PAGE]:
+            self.app.pool.evict("badges/halfImages/"+name)
             
     def drawIndex(self):
         left = ICONS_ACROSS*ICON_SIZE+8
@@ -398,12 +406,14 @@ class IconSelector(AbstractScreen):
         self.app.queueUpdate(0,badger2040.UPDATE_NORMAL)
     
     def button_a(self):
+        self.evictPage()
         self.app.setScreen(self.badge)
     
     def button_b(self):
         self.nextPage()
     
     def button_c(self):
+        self.evictPage()
         self.badge.setImage("badges/images/"+self.fileNames[self.index])
         self.app.setScreen(self.badge)
     
@@ -413,6 +423,17 @@ class IconSelector(AbstractScreen):
     def button_down(self):
         self.updateDelta(1)
 
+def cachedFile(pool,fileName,size):
+    # Check the file exists first, so a missing one doesn't evict other entries to make room
+    os.stat(fileName)
+    return pool.cached(fileName,size,loadFile)
+
+def loadFile(fileName,buf):
+    with open(fileName) as f:
+        n = f.readinto(buf) or 0
+    # Pooled buffers are reused, so clear anything a short file didn't overwrite
+    buf[n:] = bytes(len(buf)-n)
+
 def drawWrappedText(text,x,y,width,scale,lineHeight):
     while text:
         for i in range(len(text),0,-1):